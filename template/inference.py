@@ -6,6 +6,8 @@ SAPC inference file with whisper base model. Please modify it w.r.t. your own mo
 """
 
 import argparse, os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import whisper
 
@@ -26,8 +28,22 @@ def get_parser():
     parser.add_argument(
         "--output-name", default="/taiga/downloads/???/???/inference/???.hypo", type=str, metavar="OUTPUT-NAME", help="???s represent team name, submission pk, and split."
     )
+    parser.add_argument(
+        "--num-prefetch", default=2, type=int, metavar="NUM-PREFETCH", help="number of audio files decoded ahead of the model"
+    )
     return parser
 
+def prefetch_audio(fpths, num_prefetch):
+    """Decode audio files in background threads so disk I/O overlaps inference."""
+    with ThreadPoolExecutor(max_workers=max(1, num_prefetch)) as executor: ### 0 disables read-ahead
+        pending = deque()
+        for fpth in fpths:
+            pending.append(executor.submit(whisper.load_audio, fpth))
+            if len(pending) > num_prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
 def main(args):
     
     ######## TO-DO 1: load your own model ########
@@ -39,24 +55,49 @@ def main(args):
         for i in range(tokenizer.eot)
         if all(c in "0123456789$%&-–—+£=�*…•" for c in tokenizer.decode([i]).removeprefix(" "))
     ]
+    suppress_tokens = tuple([-1] + number_tokens) ### built once, shared by every decode call
     ##############################################
     
     ### Dump Inference Results
     manifest = os.path.join(args.manifest_pth, args.split + ".tsv")
-    with open(manifest, "r") as ftsv, open(args.output_name, "w") as fhypo:
+    with open(manifest, "r") as ftsv:
+        num_lines = sum(1 for _ in ftsv) - 1
+    with open(manifest, "r") as ftsv, open(args.output_name, "w", buffering=1) as fhypo:
         next(ftsv)
-        for t in tqdm(ftsv.readlines()):
-            fname = t.strip().split()[0].split("/")[-1]
+        fpths = (
+            os.path.join(args.data_pth, args.split, t.strip().split()[0].split("/")[-1])
+            for t in ftsv
+        )
+        for audio in tqdm(prefetch_audio(fpths, args.num_prefetch), total=num_lines):
             
             ######## TO-DO 2: modify the following inference scripts ########
-            result = model.transcribe(
-                os.path.join(args.data_pth, args.split, fname),
-                suppress_tokens=[-1] + number_tokens,
-                temperature=0.0
-            )
+            if audio.shape[-1] <= whisper.audio.N_SAMPLES:
+                ### single 30s window: encode once and decode, skipping language detection
+                mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=model.dims.n_mels).to(model.device)
+                result = whisper.decode(
+                    model,
+                    mel,
+                    whisper.DecodingOptions(
+                        language="en",
+                        without_timestamps=True,
+                        suppress_tokens=suppress_tokens,
+                        temperature=0.0,
+                        fp16=model.device.type == "cuda"
+                    )
+                )
+                ### same no-speech gate as transcribe() (no_speech_threshold=0.6, logprob_threshold=-1.0)
+                text = "" if result.no_speech_prob > 0.6 and result.avg_logprob <= -1.0 else result.text
+            else:
+                result = model.transcribe(
+                    audio,
+                    language="en",
+                    suppress_tokens=suppress_tokens,
+                    temperature=0.0
+                )
+                text = result["text"]
             #################################################################
             
-            print(result["text"].strip(), file=fhypo)
+            print(text.strip(), file=fhypo)
 
 if __name__ == "__main__":
     parser = get_parser()
@@ -1,22 +1,32 @@
 #!/usr/bin/env python3
 # By xiuwenz2@illinois.edu, Oct. 08, 2024.
 
-import argparse, os, re, torch, json
+import argparse, os, torch, json
+import numpy as np
 from metrics import calculate_word_error_rate, SemScore
 from tqdm import tqdm
 
 
-def process_punc(trans):
+PUNC_KEEP = frozenset(
+    [chr(c) for c in range(0x41, 0x5a + 1)] + ["'", " ", "\n"]
+    + list("\u00c0\u00c1\u00c4\u00c5\u00c8\u00c9\u00cd\u00cf")
+    + list("\u00d1\u00d3\u00d6\u00d8\u00db\u00dc\u0106")
+)
+
+class PuncTable(dict):
+    """str.translate table deleting every character outside PUNC_KEEP, filled on first sight."""
+
+    def __missing__(self, codepoint):
+        value = codepoint if chr(codepoint) in PUNC_KEEP else None
+        self[codepoint] = value
+        return value
 
-    codes = '''
-            \u0041-\u005a\u0027\u0020
-            \u00c0\u00c1\u00c4\u00c5\u00c8\u00c9\u00cd\u00cf
-            \u00d1\u00d3\u00d6\u00d8\u00db\u00dc\u0106
-            '''
+PUNC_TABLE = PuncTable()
+
+def process_punc(trans):
 
-    trans = trans.strip().upper()
-    trans = re.sub(u"([^"+codes+"])", "", trans)
-    trans = ' '.join(trans.strip().split())
+    trans = trans.strip().upper().translate(PUNC_TABLE)
+    trans = ' '.join(trans.split())
 
     return trans
 
@@ -31,6 +41,8 @@ def evaluate(submission, hypo_pth, ref_pth, **kwargs):
         references = {"ref1":[], "ref2":[]}
         hypotheses = []
 
+        with open(os.path.join(hypo_pth, split+".hypo"), "r") as fhypo:
+            num_lines = sum(1 for _ in fhypo)
         with open(
             os.path.join(ref_pth, split+".ref1"), "r"
             ) as fref1, open(
@@ -38,7 +50,7 @@ def evaluate(submission, hypo_pth, ref_pth, **kwargs):
             ) as fref2, open(
             os.path.join(hypo_pth, split+".hypo"), "r"
             ) as fhypo:
-            for r1, r2, h in tqdm(zip(fref1.readlines(), fref2.readlines(), fhypo.readlines())):
+            for r1, r2, h in tqdm(zip(fref1, fref2, fhypo), total=num_lines):
                 references['ref1'].append(process_punc(r1.strip()))
                 references['ref2'].append(process_punc(r2.strip()))
                 hypotheses.append(process_punc(h.strip()))
@@ -50,9 +62,9 @@ def evaluate(submission, hypo_pth, ref_pth, **kwargs):
         semscores = {}
         for ref_type in ["ref1", "ref2"]:
             semscores[ref_type] = SemScore().score_all(refs=references[ref_type], hyps=hypotheses)
-        semscore = [i if i > j else j for i, j in zip(semscores["ref1"], semscores["ref2"])]
+        semscore = np.maximum(np.asarray(semscores["ref1"]), np.asarray(semscores["ref2"])).mean()
 
-        output[split_name] = [round(wer * 100, 4), round(sum(semscore) / len(semscore) * 100, 4)]
+        output[split_name] = [round(wer * 100, 4), round(float(semscore) * 100, 4)]
 
     json.dump(output, open(os.path.join("/taiga", "results", submission+".json"), "w"), indent=6)
     print(f"The evaluation for submission {submission} has been successfully completed.")
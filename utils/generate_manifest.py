@@ -6,10 +6,12 @@ Data pre-processing: generate .tsv and .origin.wrd manifest.
 """
 
 import argparse, os, re, json
-from pydub import AudioSegment
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
 import soundfile as sf
 from tqdm import tqdm
 
+BRACKETS = re.compile(r"\[.*?\]")
 
 def get_parser():
     parser = argparse.ArgumentParser()
@@ -25,84 +27,110 @@ def get_parser():
     parser.add_argument(
         "--manifest-dir", default="???", metavar="MANIFEST-DIR", help="manifest directory containing .tsv files"
     )
+    parser.add_argument(
+        "--workers", default=os.cpu_count(), type=int, metavar="WORKERS", help="number of worker processes"
+    )
     return parser
 
-def generate_content(content, doc_pt, ):
+def load_json(fpt):
+    with open(fpt, "r") as fin:
+        try:
+            return json.load(fin)
+        except:
+            return None
+
+def generate_content(content, doc_pt, workers):
+    fpts = []
     for root, ds, fs in os.walk(doc_pt):
         for f in fs:
             assert f.endswith(".json")
-            with open(os.path.join(root, f), "r") as fin:
-                try:
-                    for item in json.load(fin)['Files']:
-                        fname = item['Filename']
-                        content[fname] = item["Prompt"]["Transcript"]
-                except:
-                    continue
+            fpts.append(os.path.join(root, f))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for data in executor.map(load_json, fpts):
+            try:
+                for item in data['Files']:
+                    fname = item['Filename']
+                    content[fname] = item["Prompt"]["Transcript"]
+            except:
+                continue
     return content
 
+def read_info(fpt):
+    with sf.SoundFile(fpt) as snd:
+        return snd.frames, snd.frames / snd.samplerate
+
 def process_timestamps(fpt, trans):
-    trans = re.sub(u"\\[.*?]", "", trans).strip()
+    trans = BRACKETS.sub("", trans).strip()
     timestamps = trans.strip().split('\n')[1:]
     
     duration = 0
     transcriptions = []
+    ranges = []
     
     for timestamp in timestamps:
         if timestamp == " ":
             continue
         ts_ls = timestamp.strip().split()
-        duration += (float(ts_ls[1].strip()) - float(ts_ls[0].strip()))
+        start_time, end_time = float(ts_ls[0].strip()), float(ts_ls[1].strip())
+        duration += (end_time - start_time)
         transcriptions.append(" ".join(ts_ls[2:]))
+        ranges.append((start_time, end_time))
     
-    if abs(round(duration, 2) - round(sf.info(fpt).duration, 2)) <= 0.02:
+    frames, audio_duration = read_info(fpt)
+    if abs(round(duration, 2) - round(audio_duration, 2)) <= 0.02:
         # print("Timestamps are already processed for", fpt)
-        return " ".join(transcriptions), "{}\t{}".format(fpt, sf.info(fpt).frames)
-        
-    audio = AudioSegment.from_wav(fpt)
-    combined = AudioSegment.empty() 
-    
-    for timestamp in timestamps:
-        if timestamp == " ":
-            continue
-        ts_ls = timestamp.strip().split()
-        start_time = float(ts_ls[0].strip()) * 1000
-        end_time = float(ts_ls[1].strip()) * 1000
+        return " ".join(transcriptions), "{}\t{}".format(fpt, frames)
         
-        combined += audio[start_time:end_time]
+    ### read only the kept ranges rather than decoding the whole file
+    segments = [np.zeros(0, dtype=np.int16)]
+    with sf.SoundFile(fpt) as snd:
+        sr = snd.samplerate
+        for start_time, end_time in ranges:
+            start, end = min(int(start_time * sr), frames), min(int(end_time * sr), frames)
+            snd.seek(start)
+            segments.append(snd.read(max(end - start, 0), dtype="int16"))
+    combined = np.concatenate(segments)
     
-    combined.export(fpt, format="wav")
+    sf.write(fpt, combined, sr, subtype="PCM_16")
     
-    return " ".join(transcriptions), "{}\t{}".format(fpt, sf.info(fpt).frames)
+    return " ".join(transcriptions), "{}\t{}".format(fpt, len(combined))
             
+def process_file(fname, trans):
+    if "#ts" in trans:
+        trans, tsv = process_timestamps(fname, trans)
+    else:
+        trans = trans.replace("\n", " ")
+        tsv = "{}\t{}".format(fname, read_info(fname)[0])
+    return tsv.strip(), trans.strip()
+
 def main(args):
-    content = generate_content({}, os.path.join(args.data_dir, "doc"), )
+    content = generate_content({}, os.path.join(args.data_dir, "doc"), args.workers)
     
     audio_excluded_dict = json.load(open(os.path.join(args.data_dir, "doc", "SpeechAccessibility_"+args.release+"_Audio_Excluded.json")))
     
+    fnames, transs = [], []
+    for root, _, files in os.walk(os.path.join(args.data_dir, "processed", args.split)):
+        for file in files:
+            if file in audio_excluded_dict:
+                print("Skip", file, ", as it is excluded in the new release.")
+                continue
+            try:
+                trans = content[file]
+            except:
+                print("Skip", file, ", as it is not found in the new release.")
+                continue
+            fnames.append(os.path.join(args.data_dir, "processed", args.split, file))
+            transs.append(trans)
+    
     with open(
         os.path.join(args.manifest_dir, args.split + ".tsv"), "w"
     ) as ftsv, open(
         os.path.join(args.manifest_dir, args.split+".origin.wrd"), "w"
-    ) as fwrd:
+    ) as fwrd, ProcessPoolExecutor(max_workers=args.workers) as executor:
         print("{}".format(os.path.join(args.manifest_dir, args.split)), file=ftsv)
-        for root, _, files in os.walk(os.path.join(args.data_dir, "processed", args.split)):
-            for file in tqdm(files):
-                fname = os.path.join(args.data_dir, "processed", args.split, file)
-                if file in audio_excluded_dict:
-                    print("Skip", file, ", as it is excluded in the new release.")
-                    continue
-                try:
-                    trans = content[file]
-                except:
-                    print("Skip", file, ", as it is not found in the new release.")
-                    continue
-                if "#ts" in trans:
-                    trans, tsv = process_timestamps(fname, trans)
-                else:
-                    trans = re.sub(u"\n", " ", trans)
-                    tsv = "{}\t{}".format(fname, sf.info(fname).frames)
-                print(tsv.strip(), file=ftsv)
-                print(trans.strip(), file=fwrd)
+        results = list(tqdm(executor.map(process_file, fnames, transs, chunksize=32), total=len(fnames)))
+        ftsv.write("".join(tsv + "\n" for tsv, _ in results))
+        fwrd.write("".join(trans + "\n" for _, trans in results))
 
 if __name__ == "__main__":
     parser = get_parser()
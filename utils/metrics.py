@@ -3,6 +3,8 @@
 
 import numpy as np
 import jellyfish, editdistance, torch
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 from bert_score import score as bert_score
 
@@ -17,20 +19,20 @@ def calculate_word_error_rate(references1, references2, hypotheses):
         r2 = ref2.strip().split()
         h  = hyp.strip().split()
 
-        distance = [min(editdistance.eval(h, r1), len(r1)), min(editdistance.eval(h, r2), len(r2))]
-        length = [len(r1), len(r2)]
-        wer = [d/l for d, l in zip(distance, length)]
+        l1, l2 = len(r1), len(r2)
+        d1, d2 = min(editdistance.eval(h, r1), l1), min(editdistance.eval(h, r2), l2)
+        wer1, wer2 = d1 / l1, d2 / l2
 
-        if wer[0] == wer[1]:
-            distances += np.mean(distance)
-            lengths += np.mean(length)
-        elif wer[0] < wer[1]:
-            distances += distance[0]
-            lengths += length[0]
+        if wer1 == wer2:
+            distances += (d1 + d2) / 2
+            lengths += (l1 + l2) / 2
+        elif wer1 < wer2:
+            distances += d1
+            lengths += l1
         else:
-            assert wer[0] > wer[1]
-            distances += distance[1]
-            lengths += length[1]
+            assert wer1 > wer2
+            distances += d2
+            lengths += l2
 
     assert lengths != 0
 
@@ -46,6 +48,8 @@ class SemScore:
                  nli_weight=0.4012,
                  bert_weight=0.2785,
                  phonetic_weight=0.3201,
+                 half_precision=False,
+                 compile_model=False,
                  **metric_conf):
         if device is None:
             self.device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -58,6 +62,8 @@ class SemScore:
         self.nli_weight = float(nli_weight)
         self.bert_weight = float(bert_weight)
         self.phonetic_weight = float(phonetic_weight)
+        self.half_precision = half_precision # bf16/fp16 NLI weights on CUDA; off by default to keep official scores
+        self.compile_model = compile_model
         self.metric_config = metric_conf
         self.metric, self.metric_hash = None, None  # Initialize metric (not used here)
 
@@ -65,46 +71,45 @@ class SemScore:
         self._model, self._tokenizer = self.get_model()
 
     def collate_input_features(self, pre, hyp):
-        tokenized_input_seq_pair = self._tokenizer.encode_plus(pre, hyp,
-                                                               max_length=self._tokenizer.model_max_length,
-                                                               return_token_type_ids=True, truncation=True)
-        input_ids = torch.Tensor(tokenized_input_seq_pair['input_ids']).long().unsqueeze(0).to(self.device)
-        token_type_ids = torch.Tensor(tokenized_input_seq_pair['token_type_ids']).long().unsqueeze(0).to(self.device)
-        attention_mask = torch.Tensor(tokenized_input_seq_pair['attention_mask']).long().unsqueeze(0).to(self.device)
+        tokenized_input_seq_pair = self._tokenizer(pre, hyp,
+                                                   max_length=self._tokenizer.model_max_length,
+                                                   return_token_type_ids=True, truncation=True,
+                                                   padding=True, return_tensors='pt')
+        # pinned host memory lets the host-to-device copies run asynchronously on CUDA
+        pin = torch.device(self.device).type == "cuda"
+        input_ids, token_type_ids, attention_mask = [
+            (tokenized_input_seq_pair[k].pin_memory() if pin else tokenized_input_seq_pair[k]).to(self.device, non_blocking=pin)
+            for k in ('input_ids', 'token_type_ids', 'attention_mask')
+        ]
 
         return input_ids, token_type_ids, attention_mask
 
+    def predict_nli(self, pres, hyps):
+        probs = []
+        for i in range(0, len(pres), self.batch_size):
+            input_ids, token_type_ids, attention_mask = self.collate_input_features(pres[i:i + self.batch_size],
+                                                                                    hyps[i:i + self.batch_size])
+            logits = self._model(input_ids,
+                                 attention_mask=attention_mask,
+                                 token_type_ids=token_type_ids,
+                                 labels=None)[0]
+            probs.append(torch.softmax(logits.float(), 1).detach().cpu().numpy())
+        return np.concatenate(probs, 0)
+
     def score_nli(self, refs, hyps, direction=None, formula='e'):
         direction = direction if direction is not None else self.direction
         # print(f'Computing NLI scores (direction: {direction}, formula: {formula})...')
         
         probs_rh, probs_hr, probs_avg = {}, {}, {}
+        refs, hyps = list(refs), list(hyps)
         
-        with torch.no_grad():
+        with torch.inference_mode():
             if direction in ['rh', 'avg']:
-                probs = []
-                for ref, hyp in zip(refs, hyps):
-                    input_ids, token_type_ids, attention_mask = self.collate_input_features(ref, hyp)
-                    logits = self._model(input_ids,
-                                         attention_mask=attention_mask,
-                                         token_type_ids=token_type_ids,
-                                         labels=None)[0]
-                    prob = torch.softmax(logits, 1).detach().cpu().numpy()
-                    probs.append(prob)
-                concatenated = np.concatenate(probs, 0)
+                concatenated = self.predict_nli(refs, hyps)
                 probs_rh['e'], probs_rh['n'], probs_rh['c'] = concatenated[:, 0], concatenated[:, 1], concatenated[:, 2]
 
             if direction in ['hr', 'avg']:
-                probs = []
-                for ref, hyp in zip(refs, hyps):
-                    input_ids, token_type_ids, attention_mask = self.collate_input_features(hyp, ref)
-                    logits = self._model(input_ids,
-                                         attention_mask=attention_mask,
-                                         token_type_ids=token_type_ids,
-                                         labels=None)[0]
-                    prob = torch.softmax(logits, 1).detach().cpu().numpy()
-                    probs.append(prob)
-                concatenated = np.concatenate(probs, 0)
+                concatenated = self.predict_nli(hyps, refs)
                 probs_hr['e'], probs_hr['n'], probs_hr['c'] = concatenated[:, 0], concatenated[:, 1], concatenated[:, 2]
 
             if direction == 'rh':
@@ -120,16 +125,19 @@ class SemScore:
 
     def score_all(self, refs, hyps, srcl='en'):
         
-        bert_scores = calculate_bert_score(refs, hyps, self.device).tolist() # Bert Score
-        bert_scores = self.min_max_normalize(bert_scores, [-0.1180, 1])
-        
-        phonetic_scores = []
-        for ref, hyp in zip(refs, hyps):
-            phonetic_score = calculate_phonetic_similarity(ref, hyp)
-            phonetic_scores.append(phonetic_score)
-        phonetic_scores = self.min_max_normalize(phonetic_scores, [0.5, 1]) # phonetic score
+        # phonetic scores are CPU-only, so compute them while the GPU runs BERTScore and NLI
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            phonetic_future = executor.submit(
+                lambda: [calculate_phonetic_similarity(ref, hyp) for ref, hyp in zip(refs, hyps)]
+            )
+            
+            bert_scores = calculate_bert_score(refs, hyps, self.device).tolist() # Bert Score
+            bert_scores = self.min_max_normalize(bert_scores, [-0.1180, 1])
+
+            nli_scores = self.score_nli(refs, hyps, formula='e')
+            
+            phonetic_scores = self.min_max_normalize(phonetic_future.result(), [0.5, 1]) # phonetic score
 
-        nli_scores = self.score_nli(refs, hyps, formula='e')
         nli_scores = self.min_max_normalize(nli_scores, [0.0028752246871590614, 0.9661698341369629])
         
         combined_scores = [
@@ -141,10 +149,14 @@ class SemScore:
 
     def get_model(self):
         if self.model_type == 'R':
-            tokenizer = AutoTokenizer.from_pretrained('ynie/roberta-large-snli_mnli_fever_anli_R1_R2_R3-nli', use_fast=False, cache_dir='.cache')
+            tokenizer = AutoTokenizer.from_pretrained('ynie/roberta-large-snli_mnli_fever_anli_R1_R2_R3-nli', use_fast=True, cache_dir='.cache')
             model = AutoModelForSequenceClassification.from_pretrained('ynie/roberta-large-snli_mnli_fever_anli_R1_R2_R3-nli', num_labels=3, cache_dir='.cache')
         model.eval()
         model = model.to(self.device)
+        if self.half_precision and torch.device(self.device).type == "cuda":
+            model = model.to(torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16)
+        if self.compile_model:
+            model = torch.compile(model, dynamic=True)
         return model, tokenizer
 
     def min_max_normalize(self, scores, thre):
@@ -158,7 +170,9 @@ def calculate_bert_score(reference, hypothesis, device):
     P, R, F1 = bert_score(reference, hypothesis, lang="en", rescale_with_baseline=True, device=device)
     return F1
 
+soundex = lru_cache(maxsize=65536)(jellyfish.soundex) # refs repeat across hypotheses
+
 def calculate_phonetic_similarity(reference, hypothesis):
-    hypo_soundex = jellyfish.soundex(hypothesis)
-    ref_soundex = jellyfish.soundex(reference)
+    hypo_soundex = soundex(hypothesis)
+    ref_soundex = soundex(reference)
     return jellyfish.jaro_winkler_similarity(hypo_soundex, ref_soundex)
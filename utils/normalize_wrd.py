@@ -5,11 +5,34 @@
 Data pre-processing: text normalization, .origin.wrd to .wrd.
 """
 
-import argparse, os, re, json
+import argparse, os, re, json, multiprocessing
+from itertools import islice
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 from nemo_text_processing.text_normalization.normalize import Normalizer
+from prefetch import prefetch
 # PUNC = r"[─()<>\-/\[\]{}｢｣､〜〰–—‛“”„‟…‧﹏.,:?~!\"\+*~;]"
 
+QUOTES = str.maketrans({"’": "'", "‘": "'"})
+BRACKETS = re.compile(r"\[(.*?)\]")
+BRACES = re.compile(r"\{(.*?)\}")
+STAR_TILDE = str.maketrans({"*": " ", "~": " "})
+PARENTHESES = re.compile(r"\((.*?)\)")
+TRAILING_BRACKET = re.compile(r"(.*?)\]")
+COLON_PREFIX = re.compile(r"(.+(?=:))")
+COLON = re.compile(r":")
+DIGITS = re.compile(r"\d+")
+AT = re.compile(r"@")
+DOT = re.compile(r"\.")
+CODES = (
+    "\u0041-\u005a\u0027\u0020"
+    "\u00c0\u00c1\u00c4\u00c5\u00c8\u00c9\u00cd\u00cf"
+    "\u00d1\u00d3\u00d6\u00d8\u00db\u00dc"
+    "\u0106"
+)
+NON_CODES = re.compile(u"([^"+CODES+"])")
+
 def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -27,14 +50,128 @@ def get_parser():
     parser.add_argument(
         '--remove-parentheses', action='store_true', help="removing disfluent parts within paratheses in the transcripts"
     )
+    parser.add_argument(
+        "--batch-size", default=256, type=int, metavar="BATCH-SIZE", help="number of lines per worker task"
+    )
+    parser.add_argument(
+        "--workers", default=os.cpu_count(), type=int, metavar="WORKERS", help="number of worker processes"
+    )
     return parser
 
-def main(args):
+def replace_braces(match):
+    con = match.group(1)
+    prefix = COLON_PREFIX.search(con) if con != " " else None ### "{ }" needs no regex
+    prefix = prefix.group() if prefix else None
+    if prefix == "w":
+        digits = DIGITS.findall(con)
+        assert len(digits) == 1
+        num_unk = int(digits[0])
+        con_ = " ".join(("UNK",) * num_unk)
+    elif con == " " or prefix == "u":
+        con_ = "UNK"
+    else:
+        con_ = COLON_PREFIX.sub(" ", con)
+    return "{"+COLON.sub(" ", con_)+"}"
+
+def drop_parentheses(match):
+    con = match.group(1)
+    con_ = COLON_PREFIX.sub(" ", con) if COLON_PREFIX.search(con) else ""
+    return COLON.sub(" ", con_)
+
+def preprocess(trans):
+    
+    # change "\’" & "\‘" back to "\'"
+    trans = trans.translate(QUOTES)
+    
+    if "]" in trans:
+        # remove "[...]" by removing them
+        ### trans = re.sub(u"\\[.*?] ", "", trans)
+        trans = BRACKETS.sub(" ", trans)
+        
+        # process "...]"
+        trans = TRAILING_BRACKET.sub(" ", trans)
+    
+    # process "{...}" by replacing unknown words and retaining uncertain words
+    if "{" in trans:
+        trans = BRACES.sub(replace_braces, trans)
+        
+    # remove "*", "~" before nemo_text_processing
+    trans = trans.translate(STAR_TILDE)
+    
+    trans = ' '.join(trans.strip().split()) ### remove extra space
+    
+    return trans
+
+def postprocess(trans, fname, error_correction_dict, abbreviation_decomposition_dict, remove_parentheses):
+    
+    # normalize unusual email addresses
+    if "@" in trans:
+        content = [DOT.sub(" dot ", con[:-1])+con[-1] for con in trans.split()]
+        trans = " ".join(content)
+        trans = AT.sub(" at ", trans)
     
+    # fix trans mismatch manually
+    ### including mismatch caused by the normalizer, mismatch of brackets, utt with abnormal WER, M.P. issue...
+    trans = error_correction_dict.get(fname, trans)
+    trans = abbreviation_decomposition_dict.get(fname, trans)
+    ### including mismatch caused by the normalizer, mismatch of the brackets, utt with abnormal WER, abbr issues...
+    
+    if "(" in trans:
+        if remove_parentheses:
+            # process "(...)" by removing them while keeping "(cs:...)"
+            trans = PARENTHESES.sub(drop_parentheses, trans)
+        else:
+            assert remove_parentheses is False
+            trans = PARENTHESES.sub(lambda x: "("+COLON_PREFIX.sub(" ", x.group()[1:-1])+")", trans) ### this rule keeps "(...)" rather than removing them
+    
+    # upper case
+    trans = trans.upper()
+    
+    # remove punc except "\'"
+    trans = NON_CODES.sub(" ", trans)
+
+    # remove extra "'" and extra space
+    s = " ".join(t for t in (con.strip("'") for con in trans.split()) if t)
+    
+    return s
+
+def init_globals(data_dir, release):
+    
+    # built once in the parent; forked workers inherit them copy-on-write
+    global normalizer, error_correction_dict, abbreviation_decomposition_dict
     normalizer = Normalizer(input_case='cased', lang='en')             
-    error_correction_dict = json.load(open(os.path.join(args.data_dir, "doc", "SpeechAccessibility_"+args.release+"_Error_Correction.json")))
-    abbreviation_decomposition_dict = json.load(open(os.path.join(args.data_dir, "doc", "SpeechAccessibility_"+args.release+"_Abbreviation_Decomposition.json")))
+    error_correction_dict = json.load(open(os.path.join(data_dir, "doc", "SpeechAccessibility_"+release+"_Error_Correction.json")))
+    abbreviation_decomposition_dict = json.load(open(os.path.join(data_dir, "doc", "SpeechAccessibility_"+release+"_Abbreviation_Decomposition.json")))
+    ### strip the manual transcripts once here rather than on every hit
+    error_correction_dict = {k: v.strip() for k, v in error_correction_dict.items()}
+    abbreviation_decomposition_dict = {k: v.strip() for k, v in abbreviation_decomposition_dict.items()}
+
+def process_batch(batch, remove_parentheses):
+    
+    # nemo_text_processing
+    ### normalize_list only loops over normalize() with joblib and a tqdm bar per line
+    normalized = [
+        normalizer.normalize(preprocess(item.strip()), verbose=False, punct_post_process=True) for item, _ in batch
+    ]
+    
+    out = []
+    for trans, (_, t) in zip(normalized, batch):
+        fname = t.split(None, 1)[0].rpartition("/")[2]
+        s = postprocess(trans, fname, error_correction_dict, abbreviation_decomposition_dict, remove_parentheses)
+        out.append(f'{s}\n')
+    return out
 
+def get_batches(lines, batch_size):
+    while True:
+        batch = list(islice(lines, batch_size))
+        if not batch:
+            break
+        yield batch
+
+def main(args):
+    
+    init_globals(args.data_dir, args.release)
+    
     if args.remove_parentheses:
         out_ext = ".wrd.without.parentheses"
     else:
@@ -46,91 +183,19 @@ def main(args):
         os.path.join(args.manifest_dir, args.split + ".origin.wrd"), "r"
     ) as fin, open(
         os.path.join(args.manifest_dir, args.split + out_ext), "w"
-    ) as fout:
+    ) as fout, ProcessPoolExecutor(
+        max_workers=args.workers, mp_context=multiprocessing.get_context("fork")
+    ) as executor:
         next(ftsv)
-        for item, t in tqdm(zip(fin.readlines(), ftsv.readlines())):            
-            
-            trans = item.strip()
-            
-            # change "\’" & "\‘" back to "\'"
-            trans = re.sub(r"[\’\‘]", r"'", trans)
-            
-            # remove "[...]" by removing them
-            ### trans = re.sub(u"\\[.*?] ", "", trans)
-            trans = re.sub("\[(.*?)\]", " ", trans)
-            
-            # process "...]"
-            content = re.findall("(.*?)\]", trans)
-            if len(content) > 0:
-                trans = re.sub("(.*?)\]", " ", trans)
-            
-            # process "{...}" by replacing unknown words and retaining uncertain words
-            content = re.findall("\{(.*?)\}", trans)
-            if len(content) > 0:
-                content_ = []
-                for con in content:
-                    if re.findall("(.+(?=:))", con) and re.findall("(.+(?=:))", con)[0]=="w":
-                        assert len(re.findall(r"\d+", con)) == 1
-                        num_unk = int(re.findall(r"\d+", con)[0])
-                        content_.append(" ".join(["UNK" for i in range(num_unk)]))
-                    elif (re.findall("(.+(?=:))", con) and re.findall("(.+(?=:))", con)[0]=="u") or con==" ":
-                        content_.append(" ".join(["UNK" for i in range(1)]))
-                    else:
-                        content_.append(re.sub("(.+(?=:))", " ", con))
-                mapping = {content[i]:re.sub(":", " ", content_[i]) for i in range(len(content))}
-                trans = re.sub("\{(.*?)\}", lambda x: "{"+mapping[x.group()[1:-1]]+"}", trans)
-                
-            # remove "*", "~" before nemo_text_processing
-            trans = re.sub(r"[\*\~]", " ", trans)
-            
-            # nemo_text_processing
-            trans = ' '.join(trans.strip().split()) ### remove extra space
-            trans = normalizer.normalize(trans, verbose=False, punct_post_process=True)
-            
-            # normalize unusual email addresses
-            content = re.findall("@", trans)
-            if len(content) > 0:
-                content = [re.sub("\.", " dot ", con[:-1])+con[-1] for con in trans.split()]
-                trans = " ".join(content)
-                trans = re.sub("@", " at ", trans)
-            
-            # fix trans mismatch manually
-            ### including mismatch caused by the normalizer, mismatch of brackets, utt with abnormal WER, M.P. issue...
-            fname = t.strip().split()[0].split("/")[-1]
-            trans = error_correction_dict[fname].strip() if fname in error_correction_dict else trans
-            trans = abbreviation_decomposition_dict[fname].strip() if fname in abbreviation_decomposition_dict else trans
-            ### including mismatch caused by the normalizer, mismatch of the brackets, utt with abnormal WER, abbr issues...
-            
-            if args.remove_parentheses:
-                # process "(...)" by removing them while keeping "(cs:...)"
-                content = re.findall("\((.*?)\)", trans)
-                if len(content) > 0:
-                    content_ = [re.sub("(.+(?=:))", " ", con) if re.findall("(.+(?=:))", con) else "" for con in content]
-                    mapping = {content[i]:re.sub(":", " ", content_[i]) for i in range(len(content))}
-                    trans = re.sub("\((.*?)\)", lambda x: mapping[x.group()[1:-1]], trans)
-            else:
-                assert args.remove_parentheses is False
-                trans = re.sub("\((.*?)\)", lambda x: "("+re.sub("(.+(?=:))", " ", x.group()[1:-1])+")", trans) ### this rule keeps "(...)" rather than removing them
-            
-            # upper case
-            trans = trans.upper()
-            
-            # remove punc except "\'"
-            codes = '''
-            \u0041-\u005a\u0027\u0020
-            \u00c0\u00c1\u00c4\u00c5\u00c8\u00c9\u00cd\u00cf
-            \u00d1\u00d3\u00d6\u00d8\u00db\u00dc
-            \u0106
-            ''' 
-            trans = re.sub(u"([^"+codes+"])", " ", trans)
-
-            # remove extra "'"
-            trans = " ".join([con.strip("'") for con in trans.split()])
-
-            # remove extra space
-            s = ' '.join(trans.strip().split())
-            
-            fout.write(f'{s}\n')
+        pbar = tqdm(unit="line", mininterval=0.5, miniters=1000)
+        ### at most 2 * workers batches in flight, results come back in input order
+        for out in prefetch(
+            executor, partial(process_batch, remove_parentheses=args.remove_parentheses),
+            get_batches(zip(fin, ftsv), args.batch_size), 2 * args.workers
+        ):
+            fout.write("".join(out))
+            pbar.update(len(out))
+        pbar.close()
     
 if __name__ == "__main__":
     parser = get_parser()
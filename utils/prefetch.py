@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+
+"""
+Helpers: bounded, order-preserving executor.map for the pre-processing scripts.
+"""
+
+from collections import deque
+
+def prefetch(executor, fn, items, num_prefetch):
+    """Run fn over items on executor, keeping at most num_prefetch tasks ahead of the consumer.
+
+    Unlike executor.map, items is consumed lazily, so memory stays bounded; results are yielded in input order.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) > num_prefetch:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
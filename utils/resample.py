@@ -5,8 +5,13 @@
 Data pre-processing: resample audios to 16k.
 """
 
-import argparse, os, json, librosa
+import argparse, os, json, shutil, librosa
 import soundfile as sf
+from math import gcd
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from scipy.signal import resample_poly
+from prefetch import prefetch
 
 
 def get_parser():
@@ -23,6 +28,9 @@ def get_parser():
     parser.add_argument(
         "--sr", default=16000, type=int, metavar="SAMPLERATE", help="ideal sample rate"
     )
+    parser.add_argument(
+        "--num-prefetch", default=2, type=int, metavar="NUM-PREFETCH", help="number of audio files read ahead of resampling"
+    )
     return parser
 
 def get_fn(database, release, split):
@@ -30,27 +38,45 @@ def get_fn(database, release, split):
         os.path.join(database, "doc", "SpeechAccessibility_"+release+"_Split_by_Contributors.json"), 'r'
     ) as f:
         for contributor in json.load(f)[split]:
-            for _, _, files in os.walk(os.path.join(database, "raw", contributor)):
-                for file in files:
-                    if not file.endswith(".wav"):
-                        continue
-                    yield os.path.join(database, "raw", contributor, file)
+            for fpth in Path(database, "raw", contributor).rglob("*.wav"):
+                yield str(fpth)
+
+def resample(data, orig_sr, target_sr):
+    g = gcd(orig_sr, target_sr)
+    up, down = target_sr // g, orig_sr // g
+    if max(up, down) > 1000:
+        ### odd rate pairs would need a very long polyphase filter
+        return librosa.resample(data, orig_sr=orig_sr, target_sr=target_sr)
+    return resample_poly(data, up, down)
+
+def read_audio(fname):
+    return sf.read(fname, dtype="float32")
 
 def main(args):
+    jobs = []
     for fname in get_fn(args.database, args.release, args.split):
         targ_path = os.path.join(args.database, "processed", args.split, fname.split("/")[-1])
         if os.path.exists(targ_path):
             continue
-        data, sr = sf.read(fname)
-        if len(data.shape) > 1:
-            data = data.mean(axis=1)
-        if sr != args.sr:
-            try:
-                data = librosa.resample(data, orig_sr=sr, target_sr=args.sr)
-            except:
-                print("Skip", fname, ", as it is not in the right format.")
-                continue
-        sf.write(targ_path, data, args.sr)
+        info = sf.info(fname)
+        if info.samplerate == args.sr and info.channels == 1 and info.format == "WAV" and info.subtype == "PCM_16":
+            ### already in the target format, copy instead of decoding and re-encoding
+            shutil.copyfile(fname, targ_path)
+            continue
+        jobs.append((fname, targ_path))
+    
+    fnames = [fname for fname, _ in jobs]
+    with ThreadPoolExecutor(max_workers=max(1, args.num_prefetch)) as executor: ### 0 disables read-ahead
+        for (fname, targ_path), (data, sr) in zip(jobs, prefetch(executor, read_audio, fnames, args.num_prefetch)):
+            if len(data.shape) > 1:
+                data = data.mean(axis=1)
+            if sr != args.sr:
+                try:
+                    data = resample(data, sr, args.sr)
+                except:
+                    print("Skip", fname, ", as it is not in the right format.")
+                    continue
+            sf.write(targ_path, data, args.sr, subtype="PCM_16")
 
 if __name__ == "__main__":
     parser = get_parser()